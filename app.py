@@ -1,35 +1,192 @@
 import os
+import sys
+import multiprocessing
+import atexit
 import json
+import re
+import hashlib
+import tempfile
+import zipfile
+import zlib
+import threading
 from pathlib import Path
-from flask import Flask, render_template, request, jsonify
-import PyPDF2
-from io import BytesIO
-from azure.ai.inference import ChatCompletionsClient
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import Flask, Response, render_template, request, stream_with_context
+from werkzeug.exceptions import InternalServerError
+import numpy as np
+import orjson
+import pypdfium2 as pdfium
+from azure.ai.inference import ChatCompletionsClient, EmbeddingsClient
 from azure.ai.inference.models import SystemMessage, UserMessage
 from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.transport import RequestsTransport
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
-# Global variables for Azure AI Inference client
+# Upper bound on PDF extraction workers per server process; each one holds its own copy of
+# the upload. Under gunicorn this multiplies by the worker count (see gunicorn.conf.py).
+PDF_MAX_WORKERS = int(os.environ.get('PDF_MAX_WORKERS', min(8, os.cpu_count() or 1)))
+# Batches a worker handles before it is replaced, returning its heap to the OS
+PDF_WORKER_MAX_TASKS = 20
+
+# Extraction strategy thresholds (see _choose_strategy)
+PDF_SEQ_MAX_PAGES = 10
+PDF_BATCH_MAX_PAGES = 200
+PDF_BATCH_MAX_BYTES = 8 * 1024 * 1024
+PDF_PROC_BATCH_PAGES = 100
+
+# Extracted text clean-up: whitespace runs, and lines repeated on most pages (headers/footers)
+_INLINE_WS = re.compile(r'[ \t]+')
+_LINE_EDGE_WS = re.compile(r' ?\n ?')
+_BLANK_LINES = re.compile(r'\n{3,}')
+REPEATED_LINE_RATIO = 0.6
+REPEATED_LINE_MIN_PAGES = 4
+REPEATED_LINE_MIN_COUNT = 3
+
+# Process pool shared by every pooled extraction, created lazily
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+# PDFium is not thread-safe: every in-process pdfium call must hold this lock
+_pdfium_lock = threading.Lock()
+
+# Where find_cred_json remembers the last cred.json it found, and how deep it searches
+_CRED_CACHE_FILE = Path('.cred_path_cache')
+CRED_SEARCH_MAX_DEPTH = 4
+_cred_path = None
+
+# Static part of the system prompt. Keep it byte-for-byte stable: the serving backend
+# can only reuse its prefix (KV) cache when every request starts with identical tokens.
+SYSTEM_PROMPT_PREFIX = (
+    "You are Phi-4, a helpful fitness AI.\n"
+    "Please use the context below from the user's knowledge base to help your answer. "
+    "If the context doesn't help, say so.\n"
+    "### Context\n"
+)
+
+# Sampling parameters sent with every chat completion
+COMPLETION_PARAMS = {'temperature': 0.3, 'max_tokens': 300}
+
+# LRU cache of answers keyed by _answer_cache_key(question, context)
+ANSWER_CACHE_SIZE = 512
+_answer_cache = OrderedDict()
+_answer_cache_lock = threading.Lock()
+
+# Retrieval: documents are split into ~CHUNK_SIZE-char sentence-aligned chunks at upload
+# and only the RETRIEVAL_TOP_K most relevant chunks are sent with each question
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+RETRIEVAL_TOP_K = 4
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+# Indexed documents: doc_id (sha256 of the PDF bytes) -> (chunks, normalised float32 chunk
+# embeddings), least recently used first; persisted compactly as int8 vectors plus per-chunk
+# scales in DOCUMENT_CACHE_DIR/<doc_id>.npz
+DOCUMENT_CACHE_SIZE = 32
+HASH_BLOCK_SIZE = 1024 * 1024
+DOCUMENT_CACHE_DIR = Path(os.environ.get('DOCUMENT_CACHE_DIR', 'cache'))
+_DOC_ID_RE = re.compile(r'[0-9a-f]{64}')
+_documents = OrderedDict()
+_documents_lock = threading.Lock()
+
+# Per-call limits for the embeddings API: number of inputs and (estimated) total tokens
+EMBED_BATCH_MAX_INPUTS = 2048
+EMBED_BATCH_MAX_TOKENS = 64000
+
+# Semantic answer cache: a ring buffer of normalised question embeddings
+# (SEMANTIC_CACHE_SIZE, dim), allocated on first store, with parallel answer and
+# context-digest lists; a hit needs the same context and cosine >= threshold
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_SIZE = 512
+_semantic_vectors = None
+_semantic_answers = []
+_semantic_contexts = []
+_semantic_count = 0  # filled slots (rows 0.._semantic_count-1)
+_semantic_next = 0   # slot the next store overwrites
+_semantic_cache_lock = threading.Lock()
+
+# Keep-alive connections kept per host for the Azure AI Inference endpoint
+HTTP_POOL_SIZE = 32
+
+# Global variables for Azure AI Inference clients
 client = None
 phi4_deployment = None
+embeddings_client = None
+embeddings_deployment = None
 
 def find_cred_json(start_path: str) -> str | None:
     """
-    Recursively looks for 'cred.json' under start_path.
+    Looks for 'cred.json', cheapest source first: the CRED_JSON_PATH env var,
+    the path found earlier in this process, the path cached on disk by a previous run,
+    then a walk of start_path limited to CRED_SEARCH_MAX_DEPTH levels (hidden dirs skipped).
     Returns the first match or None if not found.
     """
+    global _cred_path
+
+    env_path = os.environ.get('CRED_JSON_PATH')
+    if env_path and os.path.exists(env_path):
+        print(f"✅ Using cred.json from CRED_JSON_PATH: {env_path}")
+        return env_path
+
+    if _cred_path and os.path.exists(_cred_path):
+        return _cred_path
+
+    try:
+        cached_path = _CRED_CACHE_FILE.read_text(encoding='utf-8').strip()
+        if cached_path and os.path.exists(cached_path):
+            print(f"✅ Using cached cred.json location: {cached_path}")
+            _cred_path = cached_path
+            return cached_path
+    except OSError:
+        pass
+
     base = Path(start_path)
     print(f"🔎 Searching for cred.json under: {base.resolve()}")
-    for candidate in base.rglob('cred.json'):
-        print(f"✅ Found cred.json at: {candidate}")
-        return str(candidate)
+    base_depth = str(base).rstrip(os.sep).count(os.sep)
+    for root, dirs, files in os.walk(base):
+        if 'cred.json' in files:
+            candidate = os.path.join(root, 'cred.json')
+            print(f"✅ Found cred.json at: {candidate}")
+            _cred_path = candidate
+            try:
+                _CRED_CACHE_FILE.write_text(os.path.abspath(candidate), encoding='utf-8')
+            except OSError:
+                pass
+            return candidate
+        if root.rstrip(os.sep).count(os.sep) - base_depth >= CRED_SEARCH_MAX_DEPTH:
+            dirs[:] = []
+        else:
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
     return None
 
+def _build_transport():
+    """HTTP transport shared by the Azure clients, sized so concurrent requests reuse sockets.
+
+    urllib3-level retries are disabled exactly as azure-core's own session setup does:
+    azure-core's RetryPolicy already retries connection errors and failed responses, and
+    a second retry layer underneath it would multiply the attempts.
+    """
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_SIZE,
+        pool_maxsize=HTTP_POOL_SIZE,
+        max_retries=Retry(total=False, redirect=False, raise_on_status=False)
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    atexit.register(session.close)
+    # session_owner=False: closing one client must not close the session the other still uses
+    return RequestsTransport(session=session, session_owner=False)
+
 def initialize_azure_client():
-    """Initialize the Azure AI Inference client"""
-    global client, phi4_deployment
+    """Initialize the Azure AI Inference clients"""
+    global client, phi4_deployment, embeddings_client, embeddings_deployment
     
     try:
         # 1. Locate cred.json anywhere beneath the current directory
@@ -46,17 +203,37 @@ def initialize_azure_client():
         endpoint = cfg.get("ENDPOINT", "")
         api_key = cfg.get("API_KEY", "")
         phi4_deployment = cfg.get("MODEL_DEPLOYMENT_NAME", "Phi-4")
+        embeddings_deployment = cfg.get("EMBEDDINGS_DEPLOYMENT_NAME", "")
         
         print(f"Endpoint:                    {endpoint}")
         print(f"Model Deployment Name:      {phi4_deployment}")
+        print(f"Embeddings Deployment Name: {embeddings_deployment or '(not configured)'}")
 
-        # 4. Create the ChatCompletionsClient
+        # 4. Create the ChatCompletionsClient on a shared keep-alive connection pool
+        transport = _build_transport()
         client = ChatCompletionsClient(
             endpoint=endpoint,
             credential=AzureKeyCredential(api_key),
-            api_version="2024-05-01-preview"
+            api_version="2024-05-01-preview",
+            transport=transport
         )
+        # Keep one client (and its HTTP connection pool) for the life of the process
+        atexit.register(client.close)
         print("✅ ChatCompletionsClient created successfully!")
+
+        # 5. Create the EmbeddingsClient (optional; enables the semantic answer cache)
+        if embeddings_deployment:
+            embeddings_client = EmbeddingsClient(
+                endpoint=endpoint,
+                credential=AzureKeyCredential(api_key),
+                api_version="2024-05-01-preview",
+                transport=transport
+            )
+            atexit.register(embeddings_client.close)
+            print("✅ EmbeddingsClient created successfully!")
+
+        # 6. Open the HTTPS connection in the background so the first question doesn't pay for it
+        threading.Thread(target=_warm_up_client, daemon=True).start()
         return True
 
     except FileNotFoundError as e:
@@ -72,46 +249,531 @@ def initialize_azure_client():
         print(f"❌ Unexpected error: {e}")
         return False
 
-def chat_with_phi4_rag(user_question, retrieved_doc):
-    """Simulate an RAG flow by appending retrieved context to the system prompt."""
+def _warm_up_client():
+    """Make one cheap call (model info) to complete DNS, TLS and auth before the first question."""
+    try:
+        info = client.get_model_info()
+        print(f"✅ Connection to Azure AI Inference warmed up (model: {info.model_name})")
+    except Exception as e:
+        print(f"⚠️ Warm-up call failed, the first question will open the connection: {e}")
+
+def _answer_cache_key(question, context):
+    """16-byte digest identifying a (question, context) pair."""
+    return hashlib.blake2b((question + "\x00" + context).encode('utf-8'), digest_size=16).digest()
+
+def _get_cached_answer(key):
+    """Return the cached answer for key (marking it most recently used), or None."""
+    with _answer_cache_lock:
+        answer = _answer_cache.get(key)
+        if answer is not None:
+            _answer_cache.move_to_end(key)
+        return answer
+
+def _cache_answer(key, answer):
+    """Store an answer, evicting the least recently used entries beyond ANSWER_CACHE_SIZE."""
+    with _answer_cache_lock:
+        _answer_cache[key] = answer
+        _answer_cache.move_to_end(key)
+        while len(_answer_cache) > ANSWER_CACHE_SIZE:
+            _answer_cache.popitem(last=False)
+
+def _embedding_batches(texts):
+    """Yield lists of indices into texts, sorted by length and cut to the embed call limits.
+
+    Similar-length inputs share a batch (less padding server-side); most documents fit in one call.
+    """
+    batch, batch_tokens = [], 0
+    for index in sorted(range(len(texts)), key=lambda i: len(texts[i])):
+        tokens = len(texts[index]) // 4 + 1  # rough chars-per-token estimate
+        if batch and (len(batch) >= EMBED_BATCH_MAX_INPUTS or batch_tokens + tokens > EMBED_BATCH_MAX_TOKENS):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(index)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+def embed_texts(texts):
+    """Embed texts with the configured embeddings deployment; returns L2-normalised float32 rows."""
+    texts = list(texts)
+    rows = [None] * len(texts)
+    for batch in _embedding_batches(texts):
+        response = embeddings_client.embed(input=[texts[i] for i in batch], model=embeddings_deployment)
+        for item in response.data:
+            rows[batch[item.index]] = item.embedding
+    vectors = np.array(rows, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def _semantic_lookup(question_vector, context_key):
+    """Return the answer to the most similar cached question over the same context, or None."""
+    with _semantic_cache_lock:
+        if _semantic_vectors is None or _semantic_vectors.shape[1] != question_vector.shape[0]:
+            return None
+        count = _semantic_count
+        same_context = np.fromiter(
+            (key == context_key for key in _semantic_contexts[:count]), dtype=bool, count=count
+        )
+        if not same_context.any():
+            return None
+        scores = np.where(same_context, _semantic_vectors[:count] @ question_vector, -1.0)
+        best = int(np.argmax(scores))
+        if scores[best] >= SEMANTIC_CACHE_THRESHOLD:
+            return _semantic_answers[best]
+        return None
+
+def _semantic_store(question_vector, context_key, answer):
+    """Remember an answer in the next ring-buffer slot, overwriting the oldest once full.
+
+    The buffer is (re)allocated on first use and whenever the embedding size changes.
+    """
+    global _semantic_vectors, _semantic_answers, _semantic_contexts, _semantic_count, _semantic_next
+    with _semantic_cache_lock:
+        if _semantic_vectors is None or _semantic_vectors.shape[1] != question_vector.shape[0]:
+            _semantic_vectors = np.zeros((SEMANTIC_CACHE_SIZE, question_vector.shape[0]), dtype=np.float32)
+            _semantic_answers = [None] * SEMANTIC_CACHE_SIZE
+            _semantic_contexts = [None] * SEMANTIC_CACHE_SIZE
+            _semantic_count = _semantic_next = 0
+        slot = _semantic_next
+        _semantic_vectors[slot] = question_vector
+        _semantic_answers[slot] = answer
+        _semantic_contexts[slot] = context_key
+        _semantic_next = (slot + 1) % SEMANTIC_CACHE_SIZE
+        _semantic_count = min(_semantic_count + 1, SEMANTIC_CACHE_SIZE)
+
+def chunk_text(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """Split text into chunks of at most `size` characters, aligned to sentence boundaries.
+
+    Each chunk after the first starts with the last ~`overlap` characters of the previous
+    one (whole words only, when they fit) so that facts straddling a boundary survive retrieval.
+    """
+    # Longer sentences (tables, run-on text) are split on whitespace into pieces that
+    # still fit in a chunk behind an overlap tail
+    limit = max(size - overlap - 1, 1)
+    pieces = []
+    for sentence in _SENTENCE_END.split(text):
+        sentence = " ".join(sentence.split())
+        while len(sentence) > limit:
+            cut = sentence.rfind(" ", 1, limit + 1)
+            if cut <= 0:
+                cut = limit  # a single word longer than a chunk
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if sentence:
+            pieces.append(sentence)
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + 1 + len(piece) > size:
+            chunks.append(current)
+            tail = current[-overlap:] if overlap else ""
+            tail = tail[tail.find(" ") + 1:] if " " in tail else ""
+            current = f"{tail} {piece}" if tail and len(tail) + 1 + len(piece) <= size else piece
+        else:
+            current = f"{current} {piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+def quantize_int8(vectors):
+    """Symmetric per-row int8 quantisation: returns (int8 matrix, float32 scale per row)."""
+    scales = np.maximum(np.abs(vectors).max(axis=1) / 127, 1e-12).astype(np.float32)
+    return np.round(vectors / scales[:, np.newaxis]).astype(np.int8), scales
+
+def dequantize_int8(vectors, scales):
+    """Inverse of quantize_int8: float32 rows scaled back from int8."""
+    return vectors.astype(np.float32) * scales[:, np.newaxis]
+
+def _remember_document(doc_id, chunks, vectors, scales):
+    """Put an indexed document (int8 vectors + scales) in the in-memory LRU; returns the entry.
+
+    The vectors are dequantised once here: numpy's integer matmul does not use BLAS, so
+    scoring every question against float32 rows is several times faster than int8.
+    """
+    entry = (chunks, dequantize_int8(vectors, scales))
+    with _documents_lock:
+        _documents[doc_id] = entry
+        _documents.move_to_end(doc_id)
+        while len(_documents) > DOCUMENT_CACHE_SIZE:
+            _documents.popitem(last=False)
+    return entry
+
+def _index_signature():
+    """Settings an index depends on; a stored index built with other settings is stale."""
+    return f"{embeddings_deployment}|{CHUNK_SIZE}|{CHUNK_OVERLAP}"
+
+def get_document(doc_id):
+    """Return (chunks, float32 vectors) for an indexed document from memory or disk, or None.
+
+    Indexes built with a different embeddings deployment or chunking settings count as missing.
+    """
+    if not _DOC_ID_RE.fullmatch(doc_id or ''):
+        return None
+    with _documents_lock:
+        entry = _documents.get(doc_id)
+        if entry is not None:
+            _documents.move_to_end(doc_id)
+            return entry
+
+    path = DOCUMENT_CACHE_DIR / f"{doc_id}.npz"
+    try:
+        with np.load(path) as data:
+            if str(data['signature']) != _index_signature():
+                return None
+            chunks, vectors, scales = data['chunks'].tolist(), data['vectors'], data['scales']
+    except (OSError, KeyError):
+        return None
+    except (zipfile.BadZipFile, EOFError, zlib.error, ValueError) as e:
+        # Truncated or damaged file: drop it so the next upload re-indexes the PDF
+        print(f"⚠️ Discarding damaged document index {path.name}: {e}")
+        path.unlink(missing_ok=True)
+        return None
+    return _remember_document(doc_id, chunks, vectors, scales)
+
+def index_document(doc_id, text):
+    """Chunk, embed and persist a document under doc_id; returns False if embeddings are unavailable."""
+    if not embeddings_client:
+        return False
+    chunks = chunk_text(text)
+    if not chunks:
+        return False
+    try:
+        vectors, scales = quantize_int8(embed_texts(chunks))
+    except Exception as e:
+        print(f"⚠️ Could not embed document chunks, falling back to full context: {e}")
+        return False
+
+    _remember_document(doc_id, chunks, vectors, scales)
+    try:
+        DOCUMENT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # Unique temp file per writer, so concurrent indexers of one PDF never interleave
+        fd, tmp_path = tempfile.mkstemp(dir=DOCUMENT_CACHE_DIR, prefix=f"{doc_id}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(
+                    f,
+                    chunks=np.array(chunks, dtype=str),
+                    vectors=vectors,
+                    scales=scales,
+                    signature=np.array(_index_signature())
+                )
+            os.replace(tmp_path, DOCUMENT_CACHE_DIR / f"{doc_id}.npz")
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        print(f"⚠️ Could not persist document index: {e}")
+    return True
+
+def retrieve_chunks(doc_id, question_vector, k=RETRIEVAL_TOP_K):
+    """Return the k chunks of an indexed document most similar to the question (in document order).
+
+    Returns None if the document is unknown or was embedded with a different vector size.
+    """
+    entry = get_document(doc_id)
+    if entry is None:
+        return None
+    chunks, vectors = entry
+    if vectors.shape[1] != question_vector.shape[0]:
+        return None
+    scores = vectors @ question_vector
+    if len(chunks) > k:
+        top = np.sort(np.argpartition(scores, -k)[-k:])
+    else:
+        top = range(len(chunks))
+    return [chunks[i] for i in top]
+
+def _lookup_answer(user_question, retrieved_doc, question_vector=None, context_key=None):
+    """Check the exact and semantic answer caches.
+
+    Returns (cached_answer_or_None, cache_key, question_vector, context_key); the last three
+    are what _store_answer needs once a fresh answer has been generated.
+    """
+    # Identical question over identical context: skip the model round-trip
+    cache_key = _answer_cache_key(user_question, retrieved_doc)
+    cached = _get_cached_answer(cache_key)
+    if cached is not None:
+        return cached, cache_key, question_vector, context_key
+
+    # Paraphrase of an earlier question over the same context: reuse its answer
+    if context_key is None:
+        context_key = hashlib.blake2b(retrieved_doc.encode('utf-8'), digest_size=16).digest()
+    if question_vector is None and embeddings_client:
+        try:
+            question_vector = embed_texts([user_question])[0]
+        except Exception as e:
+            print(f"⚠️ Could not embed question, skipping semantic cache: {e}")
+    if question_vector is not None:
+        cached = _semantic_lookup(question_vector, context_key)
+        if cached is not None:
+            _cache_answer(cache_key, cached)
+    return cached, cache_key, question_vector, context_key
+
+def _store_answer(cache_key, question_vector, context_key, answer):
+    """Remember a freshly generated answer in both caches."""
+    _cache_answer(cache_key, answer)
+    if question_vector is not None:
+        _semantic_store(question_vector, context_key, answer)
+
+def _build_messages(user_question, retrieved_doc):
+    # Fixed instructions first, then the document, then (as its own message) the question,
+    # so repeated questions over one document share a byte-identical prompt prefix
+    return [
+        SystemMessage(content=SYSTEM_PROMPT_PREFIX + retrieved_doc),
+        UserMessage(content=user_question)
+    ]
+
+def chat_with_phi4_rag(user_question, retrieved_doc, question_vector=None, context_key=None):
+    """Simulate an RAG flow by appending retrieved context to the system prompt.
+
+    Callers that already embedded the question or retrieved from an indexed document can
+    pass question_vector and context_key (the document's identity) to reuse them for the
+    semantic cache.
+    """
     global client, phi4_deployment
     
     if not client:
         return "Error: Azure AI Inference client not initialized"
-    
-    system_prompt = (
-        "You are Phi-4, a helpful fitness AI.\n"
-        "We have some context from the user's knowledge base:\n"
-        f"{retrieved_doc}\n"
-        "Please use this context to help your answer. If the context doesn't help, say so.\n"
+
+    cached, cache_key, question_vector, context_key = _lookup_answer(
+        user_question, retrieved_doc, question_vector, context_key
     )
+    if cached is not None:
+        return cached
 
     try:
         response = client.complete(
-            messages=[
-                SystemMessage(content=system_prompt),
-                UserMessage(content=user_question)
-            ],
+            messages=_build_messages(user_question, retrieved_doc),
             model=phi4_deployment,
-            temperature=0.3,
-            max_tokens=300
+            **COMPLETION_PARAMS
         )
-        return response.choices[0].message.content
+        answer = response.choices[0].message.content
+        _store_answer(cache_key, question_vector, context_key, answer)
+        return answer
     except Exception as e:
         return f"Error communicating with Azure AI Inference: {str(e)}"
 
+def stream_phi4_rag(user_question, retrieved_doc, question_vector=None, context_key=None):
+    """Streaming variant of chat_with_phi4_rag: yields the answer in text deltas as they arrive.
+
+    Raises on failure instead of returning an error string, so callers can report it.
+    """
+    if not client:
+        raise RuntimeError("Azure AI Inference client not initialized")
+
+    cached, cache_key, question_vector, context_key = _lookup_answer(
+        user_question, retrieved_doc, question_vector, context_key
+    )
+    if cached is not None:
+        yield cached
+        return
+
+    response = client.complete(
+        messages=_build_messages(user_question, retrieved_doc),
+        model=phi4_deployment,
+        stream=True,
+        **COMPLETION_PARAMS
+    )
+    parts = []
+    with response:
+        for update in response:
+            if update.choices and update.choices[0].delta.content:
+                delta = update.choices[0].delta.content
+                parts.append(delta)
+                yield delta
+    _store_answer(cache_key, question_vector, context_key, "".join(parts))
+
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() == 'pdf'
+    return filename.lower().endswith('.pdf')
+
+def normalize_page_text(text):
+    """Collapse runs of spaces/tabs and blank lines (they cost prompt tokens but carry no content)."""
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    text = _LINE_EDGE_WS.sub('\n', _INLINE_WS.sub(' ', text))
+    return _BLANK_LINES.sub('\n\n', text).strip()
+
+def strip_repeated_lines(pages):
+    """Drop lines (running headers/footers) found on at least REPEATED_LINE_RATIO of the pages
+    and on at least REPEATED_LINE_MIN_COUNT pages, so short documents keep repeated content."""
+    if len(pages) < REPEATED_LINE_MIN_PAGES:
+        return pages
+    counts = Counter()
+    for page in pages:
+        counts.update({line for line in page.split('\n') if line})
+    threshold = max(REPEATED_LINE_RATIO * len(pages), REPEATED_LINE_MIN_COUNT)
+    repeated = {line for line, count in counts.items() if count >= threshold}
+    if not repeated:
+        return pages
+    return ["\n".join(line for line in page.split('\n') if line not in repeated) for page in pages]
 
-def extract_text_from_pdf(file):
+def _iter_page_range(source, start, stop):
+    """Open the PDF and yield the text of pages start..stop-1, one page at a time."""
+    pdf = pdfium.PdfDocument(source)
     try:
-        pdf_reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text()
-        return text
-    except Exception as e:
-        return f"Error extracting text: {str(e)}"
+        for index in range(start, stop):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            yield normalize_page_text(textpage.get_text_bounded())
+            textpage.close()
+            page.close()
+    finally:
+        pdf.close()
+
+def _extract_page_range(source, start, stop):
+    """Worker: return (start, [text of pages start..stop-1])."""
+    return start, list(_iter_page_range(source, start, stop))
+
+def _iter_pooled(source, ranges):
+    """Extract page ranges on the shared pool, yielding (page_no, text) in page order.
+
+    If the pool breaks (e.g. a worker was OOM-killed) it is replaced and the ranges not
+    yet yielded are retried once.
+    """
+    done = 0
+    for attempt in range(2):
+        pool = _get_pdf_pool()
+        try:
+            futures = [pool.submit(_extract_page_range, source, start, stop) for start, stop in ranges[done:]]
+            for future in futures:
+                start, texts = future.result()
+                for offset, text in enumerate(texts):
+                    yield start + offset + 1, text
+                done += 1
+            return
+        except BrokenProcessPool:
+            _discard_pdf_pool(pool)
+            if attempt:
+                raise
+
+def _page_ranges(page_count, batch_size):
+    """Split [0, page_count) into contiguous (start, stop) ranges of at most batch_size pages."""
+    return [(start, min(start + batch_size, page_count)) for start in range(0, page_count, batch_size)]
+
+def _get_pdf_pool():
+    """Return the shared extraction pool, creating it on first use.
+
+    One bounded pool serves every request thread, so at most PDF_MAX_WORKERS extraction
+    processes exist per server process; workers are recycled every PDF_WORKER_MAX_TASKS batches.
+    """
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            options = {}
+            if sys.version_info >= (3, 11):
+                options['max_tasks_per_child'] = PDF_WORKER_MAX_TASKS
+            _pdf_pool = ProcessPoolExecutor(max_workers=PDF_MAX_WORKERS, mp_context=_pdf_mp_context(), **options)
+        return _pdf_pool
+
+def _pdf_mp_context():
+    """Start method for extraction workers.
+
+    Forking a multithreaded server process (gunicorn gthread, threaded dev server) can copy
+    locks held by other threads, so workers come from a forkserver with this module
+    preloaded, or from spawn where forkserver is unavailable.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        if __name__ != '__main__':
+            context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context('spawn')
+
+def _discard_pdf_pool(pool):
+    """Drop a broken pool so the next _get_pdf_pool call builds a fresh one."""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is pool:
+            _pdf_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _choose_strategy(page_count, size_bytes):
+    """Pick how to extract a PDF: 'seq' (in-process), 'batch' (one range per worker)
+    or 'proc' (fixed-size ranges, so huge PDFs never load a giant range into one worker).
+
+    With a single worker allowed, large PDFs are also read in-process ('seq'), in ranges
+    of PDF_SEQ_MAX_PAGES pages so the PDFium lock is released between ranges.
+    """
+    if page_count <= PDF_SEQ_MAX_PAGES or PDF_MAX_WORKERS == 1:
+        return 'seq'
+    if page_count > PDF_BATCH_MAX_PAGES or size_bytes > PDF_BATCH_MAX_BYTES:
+        return 'proc'
+    return 'batch'
+
+def count_pdf_pages(source):
+    """Cheap page count: PDFium only parses the page tree, not the page contents."""
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(source)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+def _source_size(source):
+    """Size in bytes of a PDF given as bytes, a path or a seekable file object."""
+    if isinstance(source, (bytes, bytearray)):
+        return len(source)
+    if hasattr(source, 'seek'):
+        size = source.seek(0, os.SEEK_END)
+        source.seek(0)
+        return size
+    return os.path.getsize(source)
+
+def iter_pdf_pages(file, page_count=None, size_bytes=None):
+    """Yield (page_no, text) for every page of the PDF, in order, as pages become available.
+
+    Small PDFs are read sequentially (no pool overhead); larger ones are split into page
+    ranges and spread over a shared, long-lived process pool. Processes are used instead
+    of threads because PDFium is not thread-safe.
+
+    `file` may be bytes, a path or a seekable file object such as an upload's stream;
+    PDFium reads file objects in place, so small PDFs are never copied into memory.
+    """
+    source = file
+    if page_count is None:
+        page_count = count_pdf_pages(source)
+    if size_bytes is None:
+        size_bytes = _source_size(source)
+    if page_count == 0:
+        return
+
+    strategy = _choose_strategy(page_count, size_bytes)
+    if strategy == 'seq':
+        # Hold the lock for one small range at a time, never across a yield, so other
+        # threads' PDF work and streamed responses interleave with large documents
+        for start, stop in _page_ranges(page_count, PDF_SEQ_MAX_PAGES):
+            with _pdfium_lock:
+                _, texts = _extract_page_range(source, start, stop)
+            yield from enumerate(texts, start=start + 1)
+        return
+
+    # Worker processes need a picklable copy of the document
+    if hasattr(source, 'read'):
+        source.seek(0)
+        source = source.read()
+    if strategy == 'batch':
+        ranges = _page_ranges(page_count, -(-page_count // PDF_MAX_WORKERS))
+    else:
+        ranges = _page_ranges(page_count, PDF_PROC_BATCH_PAGES)
+    yield from _iter_pooled(source, ranges)
+
+def extract_text_from_pdf(file, page_count=None, size_bytes=None):
+    """Extract the full text of the PDF as a single string, without running headers/footers.
+
+    Raises if the PDF cannot be read, so callers never mistake an error for document text.
+    """
+    pages = [text for _, text in iter_pdf_pages(file, page_count, size_bytes)]
+    return "\n".join(strip_repeated_lines(pages))
+
+def json_response(payload, status=200):
+    """jsonify() equivalent serialised with orjson (much faster on multi-MB PDF text)."""
+    return app.response_class(orjson.dumps(payload), status=status, mimetype='application/json')
+
+@app.errorhandler(InternalServerError)
+def handle_internal_error(e):
+    """Report unexpected failures as JSON so the page can show them."""
+    error = e.original_exception or e
+    return json_response({'error': str(error)}, 500)
 
 @app.route('/')
 def index():
@@ -120,53 +782,171 @@ def index():
 @app.route('/upload-pdf', methods=['POST'])
 def upload_pdf():
     if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
+        return json_response({'error': 'No file part'}, 400)
     
     file = request.files['file']
     if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
+        return json_response({'error': 'No selected file'}, 400)
     
     if file and allowed_file(file.filename):
         try:
-            # Extract text from PDF
-            pdf_text = extract_text_from_pdf(BytesIO(file.read()))
+            # Hash and parse Werkzeug's spooled upload stream in place instead of copying it
+            stream = file.stream
+            digest = hashlib.sha256()
+            for block in iter(lambda: stream.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+            stream.seek(0)
+            doc_id = digest.hexdigest()
+
+            # Same PDF indexed before: skip extraction and embedding entirely
+            if embeddings_client and get_document(doc_id) is not None:
+                return json_response({'success': True, 'doc_id': doc_id})
+
+            # Extract text from PDF; failures must not reach index_document and the disk cache
+            try:
+                pdf_text = extract_text_from_pdf(
+                    stream,
+                    page_count=count_pdf_pages(stream),
+                    size_bytes=_source_size(stream)
+                )
+            except Exception as e:
+                return json_response({'error': f"Error extracting text: {str(e)}"}, 500)
+
+            # Chunk and embed once here; questions then send the doc_id instead of the text
+            if index_document(doc_id, pdf_text):
+                return json_response({'success': True, 'doc_id': doc_id})
             
-            return jsonify({
+            return json_response({
                 'success': True,
                 'text': pdf_text
             })
                 
         except Exception as e:
-            return jsonify({'error': str(e)}), 500
+            return json_response({'error': str(e)}, 500)
+    
+    return json_response({'error': 'Invalid file type'}, 400)
+
+@app.route('/upload-pdf-stream', methods=['POST'])
+def upload_pdf_stream():
+    """Like /upload-pdf, but streams one NDJSON line per page instead of buffering the whole text."""
+    if 'file' not in request.files:
+        return json_response({'error': 'No file part'}, 400)
+
+    file = request.files['file']
+    if file.filename == '':
+        return json_response({'error': 'No selected file'}, 400)
+
+    if not allowed_file(file.filename):
+        return json_response({'error': 'Invalid file type'}, 400)
+
+    def generate():
+        try:
+            for page_no, text in iter_pdf_pages(file.stream):
+                yield orjson.dumps({'page': page_no, 'text': text}) + b"\n"
+        except Exception as e:
+            yield orjson.dumps({'error': f"Error extracting text: {str(e)}"}) + b"\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def _prepare_question():
+    """Parse an /ask-question* request and pick the context to send.
+
+    Returns (error_response, None) or (None, (question, retrieved_doc, question_vector, context_key)).
+    Malformed requests are rejected with cheap checks before any parsing or model call.
+    """
+    if request.mimetype != 'application/json':
+        return json_response({'error': 'Expected an application/json body'}, 415), None
+    # content_length is None for chunked bodies; those are checked once read
+    if request.content_length == 0:
+        return json_response({'error': 'Missing request body'}, 400), None
+    if (request.content_length or 0) > app.config['MAX_CONTENT_LENGTH']:
+        return json_response({'error': 'Request body too large'}, 413), None
+
+    body = request.get_data(cache=False)
+    if not body:
+        return json_response({'error': 'Missing request body'}, 400), None
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError as e:
+        return json_response({'error': f'Invalid JSON: {e}'}, 400), None
+    if not isinstance(data, dict):
+        return json_response({'error': 'Expected a JSON object'}, 400), None
+
+    pdf_text = data.get('context') or ''
+    question = data.get('question') or ''
+    doc_id = data.get('doc_id') or ''
+    if not all(isinstance(value, str) for value in (pdf_text, question, doc_id)):
+        return json_response({'error': 'context, question and doc_id must be strings'}, 400), None
     
-    return jsonify({'error': 'Invalid file type'}), 400
+    if not (pdf_text or doc_id) or not question:
+        return json_response({'error': 'Missing context or question'}, 400), None
+
+    # Send only the chunks most relevant to the question when the document was indexed
+    retrieved_doc, question_vector, context_key = pdf_text, None, None
+    if doc_id and not embeddings_client and not pdf_text:
+        return json_response({'error': 'Embeddings are not configured, cannot answer from a doc_id'}, 503), None
+    if doc_id and embeddings_client:
+        try:
+            question_vector = embed_texts([question])[0]
+        except Exception as e:
+            if not pdf_text:
+                return json_response({'error': f'Could not embed the question: {e}'}, 503), None
+            print(f"⚠️ Could not embed question, using full context: {e}")
+        else:
+            chunks = retrieve_chunks(doc_id, question_vector)
+            if chunks is not None:
+                retrieved_doc = "\n\n".join(chunks)
+                context_key = doc_id.encode('ascii')
+
+    if not retrieved_doc:
+        return json_response({'error': 'Unknown document, please upload it again'}, 400), None
+    return None, (question, retrieved_doc, question_vector, context_key)
 
 @app.route('/ask-question', methods=['POST'])
 def ask_question():
-    try:
-        data = request.get_json()
-        pdf_text = data.get('context', '')
-        question = data.get('question', '')
-        
-        if not pdf_text or not question:
-            return jsonify({'error': 'Missing context or question'}), 400
-        
-        # Use Azure AI Inference for chat completion
-        answer = chat_with_phi4_rag(question, pdf_text)
-        
-        return jsonify({
-            'answer': answer,
-            'success': True
-        })
-            
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    error, prepared = _prepare_question()
+    if error:
+        return error
+    
+    # Use Azure AI Inference for chat completion (errors come back as the answer text)
+    answer = chat_with_phi4_rag(*prepared)
+    
+    return json_response({
+        'answer': answer,
+        'success': True
+    })
+
+@app.route('/ask-question-stream', methods=['POST'])
+def ask_question_stream():
+    """Like /ask-question, but streams the answer as Server-Sent Events.
+
+    Each event carries {"delta": text}; the stream ends with {"done": true} or {"error": message}.
+    """
+    error, prepared = _prepare_question()
+    if error:
+        return error
+
+    def generate():
+        try:
+            for delta in stream_phi4_rag(*prepared):
+                yield b"data: " + orjson.dumps({'delta': delta}) + b"\n\n"
+            yield b"data: " + orjson.dumps({'done': True}) + b"\n\n"
+        except Exception as e:
+            message = f"Error communicating with Azure AI Inference: {str(e)}"
+            yield b"data: " + orjson.dumps({'error': message}) + b"\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 if __name__ == '__main__':
     # Initialize Azure AI Inference client on startup
     if initialize_azure_client():
         print("🚀 Flask app starting with Azure AI Inference integration...")
-        app.run(debug=True)
+        print("ℹ️ Development server only; in production run: gunicorn -c gunicorn.conf.py wsgi:app")
+        app.run(threaded=True)
     else:
         print("❌ Failed to initialize Azure AI Inference client. Please check your cred.json file.")
         print("App will not start without proper Azure configuration.")
\ No newline at end of file
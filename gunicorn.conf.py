@@ -0,0 +1,14 @@
+# Gunicorn settings for wsgi:app. Requests spend most of their time waiting on
+# Azure AI Inference, so favour threads (cheap, share the caches) over processes.
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_WORKERS", 4))
+threads = int(os.environ.get("WEB_THREADS", 8))
+worker_class = "gthread"
+
+# Every gunicorn worker owns its own PDF extraction pool, so split the cores between them
+# (rounded up, and at least 2 so large PDFs still get parallel extraction on small hosts)
+os.environ.setdefault("PDF_MAX_WORKERS", str(max(2, -(-(os.cpu_count() or 1) // workers))))
+# Long enough for a large PDF upload or a slow completion
+timeout = 120
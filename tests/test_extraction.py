@@ -0,0 +1,50 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import app
+
+
+class FakePool:
+    """Runs ranges in-process; once `broken_after` ranges are submitted, later ones fail."""
+
+    def __init__(self, broken_after=None):
+        self.broken_after = broken_after
+        self.submitted = []
+        self.shut_down = False
+
+    def submit(self, fn, source, start, stop):
+        future = Future()
+        if self.broken_after is not None and len(self.submitted) >= self.broken_after:
+            future.set_exception(BrokenProcessPool("worker died"))
+        else:
+            future.set_result((start, [f"page {i + 1}" for i in range(start, stop)]))
+        self.submitted.append((start, stop))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+def test_iter_pooled_retries_unfinished_ranges_on_fresh_pool(monkeypatch):
+    broken, fresh = FakePool(broken_after=1), FakePool()
+    monkeypatch.setattr(app, '_pdf_pool', broken)
+    monkeypatch.setattr(app, 'ProcessPoolExecutor', lambda *args, **kwargs: fresh)
+
+    pages = list(app._iter_pooled('doc.pdf', app._page_ranges(7, 3)))
+
+    assert pages == [(i, f"page {i}") for i in range(1, 8)]
+    assert broken.shut_down
+    assert fresh.submitted == [(3, 6), (6, 7)]
+    assert app._pdf_pool is fresh
+
+
+def test_iter_pooled_gives_up_after_one_retry(monkeypatch):
+    monkeypatch.setattr(app, '_pdf_pool', FakePool(broken_after=0))
+    monkeypatch.setattr(app, 'ProcessPoolExecutor', lambda *args, **kwargs: FakePool(broken_after=0))
+
+    pages = app._iter_pooled('doc.pdf', app._page_ranges(4, 2))
+    with pytest.raises(BrokenProcessPool):
+        next(pages)
+    assert app._pdf_pool is None
@@ -0,0 +1,104 @@
+import numpy as np
+
+import app
+
+
+SENTENCES = " ".join(f"Sentence number {i} talks about tire pressure and tread depth." for i in range(60))
+
+
+def test_chunk_text_respects_size():
+    chunks = app.chunk_text(SENTENCES, size=200, overlap=40)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 200 for chunk in chunks)
+
+
+def test_chunk_text_overlaps_consecutive_chunks():
+    chunks = app.chunk_text(SENTENCES, size=200, overlap=40)
+    for previous, current in zip(chunks, chunks[1:]):
+        first_word = current.split(" ", 1)[0]
+        # The next chunk opens with whole words taken from the end of the previous one
+        assert first_word in previous[-40:].split(" ")
+
+
+def test_chunk_text_keeps_all_words():
+    chunks = app.chunk_text(SENTENCES, size=200, overlap=40)
+    joined = " ".join(chunks).split()
+    assert set(joined) == set(SENTENCES.split())
+
+
+def test_chunk_text_splits_long_sentences_on_whitespace():
+    words = [f"word{i}" for i in range(300)]
+    chunks = app.chunk_text(" ".join(words), size=120, overlap=20)
+    assert all(len(chunk) <= 120 for chunk in chunks)
+    for chunk in chunks:
+        assert all(word in words for word in chunk.split())
+
+
+def test_chunk_text_cuts_words_longer_than_a_chunk():
+    chunks = app.chunk_text("x" * 1000, size=100, overlap=10)
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert "".join(chunks).replace(" ", "").count("x") >= 1000
+
+
+def test_quantize_int8_preserves_score_order():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((500, 64)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    question = vectors[7] + 0.2 * rng.standard_normal(64).astype(np.float32)
+    question /= np.linalg.norm(question)
+
+    quantized, scales = app.quantize_int8(vectors)
+    question_q, question_scale = app.quantize_int8(question[np.newaxis, :])
+    scores = (quantized @ question_q[0].astype(np.int32)) * (scales * question_scale[0])
+
+    assert quantized.dtype == np.int8
+    assert np.abs(scores - vectors @ question).max() < 0.01
+    assert list(np.argsort(scores)[-4:]) == list(np.argsort(vectors @ question)[-4:])
+
+
+def test_quantize_int8_handles_zero_vectors():
+    quantized, scales = app.quantize_int8(np.zeros((2, 8), dtype=np.float32))
+    assert not quantized.any()
+    assert np.all(scales > 0)
+
+
+def test_embedding_batches_respect_limits(monkeypatch):
+    monkeypatch.setattr(app, 'EMBED_BATCH_MAX_INPUTS', 3)
+    monkeypatch.setattr(app, 'EMBED_BATCH_MAX_TOKENS', 50)
+    texts = ["a" * n for n in (40, 4, 120, 12, 80, 8, 60)]
+    batches = list(app._embedding_batches(texts))
+
+    assert sorted(i for batch in batches for i in batch) == list(range(len(texts)))
+    for batch in batches:
+        assert len(batch) <= 3
+        # Only a single oversized input may exceed the token budget on its own
+        assert len(batch) == 1 or sum(len(texts[i]) // 4 + 1 for i in batch) <= 50
+    lengths = [len(texts[i]) for batch in batches for i in batch]
+    assert lengths == sorted(lengths)
+
+
+def test_retrieve_chunks_returns_top_k_in_document_order(monkeypatch):
+    monkeypatch.setattr(app, '_documents', app.OrderedDict())
+    doc_id = "0" * 64
+    vectors = np.eye(6, dtype=np.float32)
+    quantized, scales = app.quantize_int8(vectors)
+    app._remember_document(doc_id, [f"chunk{i}" for i in range(6)], quantized, scales)
+
+    question = np.array([0, 0.1, 0, 0.9, 0.5, 0.3], dtype=np.float32)
+    assert app.retrieve_chunks(doc_id, question, k=3) == ["chunk3", "chunk4", "chunk5"]
+
+
+def test_semantic_cache_overwrites_oldest_slot(monkeypatch):
+    monkeypatch.setattr(app, 'SEMANTIC_CACHE_SIZE', 2)
+    monkeypatch.setattr(app, '_semantic_vectors', None)
+    monkeypatch.setattr(app, '_semantic_count', 0)
+    monkeypatch.setattr(app, '_semantic_next', 0)
+    questions = np.eye(3, dtype=np.float32)
+    for i in range(3):
+        app._semantic_store(questions[i], "ctx", f"answer{i}")
+
+    assert app._semantic_vectors.shape == (2, 3)
+    assert app._semantic_lookup(questions[0], "ctx") is None
+    assert app._semantic_lookup(questions[1], "ctx") == "answer1"
+    assert app._semantic_lookup(questions[2], "ctx") == "answer2"
+    assert app._semantic_lookup(questions[2], "other") is None
@@ -0,0 +1,232 @@
+import io
+from types import SimpleNamespace
+
+import numpy as np
+import orjson
+import pytest
+
+import app
+
+
+PDF_PATH = "Tires and tire pressure.pdf"
+
+
+class FakeEmbeddings:
+    def __init__(self, dim=16, fail=False):
+        self.dim = dim
+        self.fail = fail
+
+    def embed(self, input, model):
+        if self.fail:
+            raise RuntimeError("embeddings endpoint down")
+        data = []
+        for index, text in enumerate(input):
+            vector = np.zeros(self.dim)
+            for word in text.lower().split():
+                vector[hash(word) % self.dim] += 1
+            data.append(SimpleNamespace(index=index, embedding=vector.tolist()))
+        return SimpleNamespace(data=data)
+
+
+class FakeStream:
+    def __init__(self, deltas, fail_after=None):
+        self.deltas = deltas
+        self.fail_after = fail_after
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __iter__(self):
+        for count, delta in enumerate(self.deltas):
+            if count == self.fail_after:
+                raise RuntimeError("connection reset")
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
+
+
+class FakeChat:
+    def __init__(self, deltas=("Keep ", "it ", "at 2.5 bar"), fail_after=None):
+        self.deltas = deltas
+        self.fail_after = fail_after
+        self.calls = 0
+
+    def complete(self, stream=False, **kwargs):
+        self.calls += 1
+        return FakeStream(self.deltas, self.fail_after)
+
+
+def sse_events(response):
+    return [orjson.loads(event[len(b"data: "):]) for event in response.data.split(b"\n\n") if event]
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, '_answer_cache', app.OrderedDict())
+    monkeypatch.setattr(app, '_semantic_vectors', None)
+    monkeypatch.setattr(app, '_semantic_count', 0)
+    monkeypatch.setattr(app, '_semantic_next', 0)
+    monkeypatch.setattr(app, 'DOCUMENT_CACHE_DIR', tmp_path)
+    monkeypatch.setattr(app, '_documents', app.OrderedDict())
+    monkeypatch.setattr(app, 'embeddings_client', FakeEmbeddings())
+    monkeypatch.setattr(app, 'embeddings_deployment', 'embed-a')
+    return app.app.test_client()
+
+
+def upload(client):
+    with open(PDF_PATH, 'rb') as f:
+        return client.post('/upload-pdf', data={'file': (io.BytesIO(f.read()), 'doc.pdf')})
+
+
+def test_extraction_errors_are_not_indexed(client, monkeypatch, tmp_path):
+    def broken(*args, **kwargs):
+        raise RuntimeError("worker died")
+        yield
+
+    monkeypatch.setattr(app, 'iter_pdf_pages', broken)
+    response = upload(client)
+    assert response.status_code == 500
+    assert "worker died" in response.json['error']
+    assert not list(tmp_path.iterdir())
+    assert not app._documents
+
+
+def test_index_from_other_deployment_is_a_cache_miss(client, monkeypatch):
+    doc_id = upload(client).json['doc_id']
+    app._documents.clear()
+
+    monkeypatch.setattr(app, 'embeddings_deployment', 'embed-b')
+    monkeypatch.setattr(app, 'embeddings_client', FakeEmbeddings(dim=32))
+    assert app.get_document(doc_id) is None
+
+    # Re-uploading rebuilds the index with the new model
+    assert upload(client).json['doc_id'] == doc_id
+    _, vectors = app.get_document(doc_id)
+    assert vectors.shape[1] == 32
+
+
+def test_vector_size_mismatch_is_not_a_server_error(client, monkeypatch):
+    doc_id = upload(client).json['doc_id']
+    monkeypatch.setattr(app, 'embeddings_client', FakeEmbeddings(dim=32))
+    assert app.retrieve_chunks(doc_id, np.ones(32, dtype=np.float32)) is None
+
+
+def test_question_embedding_failure_returns_503(client, monkeypatch):
+    doc_id = upload(client).json['doc_id']
+    monkeypatch.setattr(app, 'embeddings_client', FakeEmbeddings(fail=True))
+    response = client.post('/ask-question', json={'doc_id': doc_id, 'question': 'Tire pressure?'})
+    assert response.status_code == 503
+    assert "embeddings endpoint down" in response.json['error']
+
+
+def test_damaged_index_file_is_discarded_and_rebuilt(client, tmp_path):
+    doc_id = upload(client).json['doc_id']
+    path = tmp_path / f"{doc_id}.npz"
+    path.write_bytes(path.read_bytes()[:100])
+    app._documents.clear()
+
+    assert app.get_document(doc_id) is None
+    assert not path.exists()
+    assert upload(client).status_code == 200
+    assert app.get_document(doc_id) is not None
+
+
+def test_index_writes_leave_no_temp_files(client, tmp_path):
+    doc_id = upload(client).json['doc_id']
+    assert [p.name for p in tmp_path.iterdir()] == [f"{doc_id}.npz"]
+
+
+def test_question_requires_json_content_type(client):
+    response = client.post('/ask-question', data='question=x', content_type='text/plain')
+    assert response.status_code == 415
+
+
+def test_question_rejects_invalid_json(client):
+    response = client.post('/ask-question', data='{bad', content_type='application/json')
+    assert response.status_code == 400
+    assert response.json['error'].startswith('Invalid JSON')
+
+
+def test_question_rejects_non_object_and_wrong_types(client):
+    response = client.post('/ask-question', json=[1, 2])
+    assert response.status_code == 400
+    response = client.post('/ask-question', json={'context': 1, 'question': 'q'})
+    assert response.status_code == 400
+
+
+def test_question_rejects_empty_body(client):
+    response = client.post('/ask-question', data=b'', content_type='application/json')
+    assert response.status_code == 400
+    assert response.json['error'] == 'Missing request body'
+
+
+def test_question_rejects_oversized_body(client, monkeypatch):
+    monkeypatch.setitem(app.app.config, 'MAX_CONTENT_LENGTH', 10)
+    response = client.post('/ask-question', json={'context': 'x' * 100, 'question': 'q'})
+    assert response.status_code == 413
+
+
+def test_question_accepts_chunked_body(client, monkeypatch):
+    monkeypatch.setattr(app, 'chat_with_phi4_rag', lambda *args: "answer")
+    body = io.BytesIO(b'{"context": "doc", "question": "q"}')
+    response = client.post(
+        '/ask-question',
+        input_stream=body,
+        content_type='application/json',
+        headers={'Transfer-Encoding': 'chunked'},
+        # Set by servers such as gunicorn once they have de-chunked the body
+        environ_overrides={'wsgi.input_terminated': True}
+    )
+    assert response.status_code == 200
+    assert response.json['answer'] == "answer"
+
+
+def test_unexpected_errors_are_reported_as_json(client, monkeypatch):
+    def broken(*args):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(app, 'chat_with_phi4_rag', broken)
+    response = client.post('/ask-question', json={'context': 'doc', 'question': 'q'})
+    assert response.status_code == 500
+    assert response.json == {'error': 'boom'}
+
+
+def test_stream_sends_deltas_then_done(client, monkeypatch):
+    monkeypatch.setattr(app, 'client', FakeChat())
+    response = client.post('/ask-question-stream', json={'context': 'doc', 'question': 'Pressure?'})
+    assert response.mimetype == 'text/event-stream'
+    assert sse_events(response) == [
+        {'delta': "Keep "}, {'delta': "it "}, {'delta': "at 2.5 bar"}, {'done': True}
+    ]
+
+
+def test_stream_answer_is_cached_after_completion(client, monkeypatch):
+    chat = FakeChat()
+    monkeypatch.setattr(app, 'client', chat)
+    payload = {'context': 'doc', 'question': 'Pressure?'}
+    sse_events(client.post('/ask-question-stream', json=payload))
+    response = client.post('/ask-question-stream', json=payload)
+    assert sse_events(response) == [{'delta': "Keep it at 2.5 bar"}, {'done': True}]
+    assert chat.calls == 1
+
+
+def test_stream_failure_sends_error_and_is_not_cached(client, monkeypatch):
+    chat = FakeChat(fail_after=2)
+    monkeypatch.setattr(app, 'client', chat)
+    payload = {'context': 'doc', 'question': 'Pressure?'}
+    events = sse_events(client.post('/ask-question-stream', json=payload))
+    assert events[:2] == [{'delta': "Keep "}, {'delta': "it "}]
+    assert "connection reset" in events[-1]['error']
+    assert 'done' not in events[-1]
+
+    chat.fail_after = None
+    events = sse_events(client.post('/ask-question-stream', json=payload))
+    assert events[-1] == {'done': True}
+    assert chat.calls == 2
+
+
+def test_stream_without_client_reports_error(client, monkeypatch):
+    monkeypatch.setattr(app, 'client', None)
+    events = sse_events(client.post('/ask-question-stream', json={'context': 'doc', 'question': 'q'}))
+    assert len(events) == 1 and "not initialized" in events[0]['error']
@@ -0,0 +1,22 @@
+import app
+
+
+def test_normalize_page_text_collapses_whitespace():
+    text = "Tire  \t pressure \r\n\r\n\r\n\r\n  Check it  \n"
+    assert app.normalize_page_text(text) == "Tire pressure\n\nCheck it"
+
+
+def test_strip_repeated_lines_removes_running_headers():
+    pages = [f"Audi A8\nContent of page {i}\nPage footer" for i in range(5)]
+    assert app.strip_repeated_lines(pages) == [f"Content of page {i}" for i in range(5)]
+
+
+def test_strip_repeated_lines_keeps_short_documents():
+    pages = ["Warning: check pressure\nA", "Warning: check pressure\nB", "C"]
+    assert app.strip_repeated_lines(pages) == pages
+
+
+def test_strip_repeated_lines_needs_minimum_page_count():
+    # 2 of 4 pages is 50%, below the ratio; 3 of 4 meets both ratio and count
+    pages = ["H\nTable heading\na", "H\nTable heading\nb", "H\nc", "d"]
+    assert app.strip_repeated_lines(pages) == ["Table heading\na", "Table heading\nb", "c", "d"]
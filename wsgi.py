@@ -0,0 +1,9 @@
+"""WSGI entry point for production servers:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from app import app, initialize_azure_client
+
+# Each worker process builds its own Azure AI Inference clients
+if not initialize_azure_client():
+    raise RuntimeError("Failed to initialize Azure AI Inference client. Please check your cred.json file.")